@@ -1,9 +1,16 @@
 # download_hf_subset.py
 
 import argparse
-from huggingface_hub import snapshot_download
+import importlib.util
 import os
 
+# Use the Rust-based hf_transfer backend for parallel chunked downloads when it is installed
+# (pip install hf_transfer). Must be set before huggingface_hub is imported.
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+from huggingface_hub import snapshot_download
+
 
 def download_subset(repo_id: str, subset_folder: str, local_dir: str = "./data"):
     """
@@ -22,7 +29,9 @@ def download_subset(repo_id: str, subset_folder: str, local_dir: str = "./data")
         repo_id=repo_id,
         repo_type="dataset",
         local_dir=local_dir,
-        allow_patterns=f"{subset_folder}/*"   # 只下载 subset_folder/ 下的文件
+        allow_patterns=f"{subset_folder}/*",   # 只下载 subset_folder/ 下的文件
+        max_workers=16,                        # 并行下载的文件数
+        etag_timeout=30
     )
 
     print(f"✅ Subset '{subset_folder}' downloaded to {os.path.join(local_dir, subset_folder)}")
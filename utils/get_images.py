@@ -4,6 +4,10 @@ import cv2
 import os
 import argparse
 import time
+import io
+import tarfile
+
+from image_io import COLOR_JPEG_PARAMS, COLOR_PNG_PARAMS, DEPTH_PNG_PARAMS, ImageWriter, imwrite
 
 
 def get_save_dir(base_dir="realsense_capture"):
@@ -29,7 +33,64 @@ def get_save_dir(base_dir="realsense_capture"):
         i += 1
 
 
-def save_image(save_dir, image_index, color_image, depth_image):
+class TarShardWriter(ImageWriter):
+    """
+    Stream images into rolling, uncompressed tar shards instead of individual files.
+
+    Each image becomes a member of a shard named by its path relative to `save_dir`
+    (e.g. "color/color_000.jpg"), so extracting the shards restores the usual folder
+    layout. A few large sequential writes avoid the per-file metadata updates of saving
+    every image separately. Images are still encoded in parallel; only appending to the
+    shards happens on the single writer thread.
+
+    The shard of an image is chosen by the capture index in its file name, not by
+    arrival order: the encoder threads may finish images out of order, but the color
+    and depth images of a capture always end up in the same shard. A shard is closed
+    once all of its images have arrived (or on join()).
+
+    Args:
+        save_dir (str): Directory where shard_000.tar, shard_001.tar, ... are written.
+        captures_per_shard (int): Number of captures stored in each shard.
+        files_per_capture (int): Number of images saved per capture (color + depth).
+        num_workers (int): Number of encoder threads (default: half the CPU count).
+        max_pending (int): Maximum number of queued images before submit() blocks.
+    """
+
+    def __init__(self, save_dir, captures_per_shard=500, files_per_capture=2, num_workers=None, max_pending=32):
+        self.save_dir = save_dir
+        self.captures_per_shard = captures_per_shard
+        self.files_per_shard = captures_per_shard * files_per_capture
+        self.shards = {}  # shard index -> [open tarfile, number of members written]
+        super().__init__(num_workers=num_workers, max_pending=max_pending)
+
+    def write_bytes(self, path, data):
+        # --- Pick the shard from the capture index, e.g. "color_012.jpg" -> 12 ---
+        image_index = int(os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[1])
+        shard_index = image_index // self.captures_per_shard
+        if shard_index not in self.shards:
+            shard_path = os.path.join(self.save_dir, f"shard_{shard_index:03d}.tar")
+            self.shards[shard_index] = [tarfile.open(shard_path, "w|", bufsize=4 << 20), 0]
+        shard = self.shards[shard_index]
+
+        info = tarfile.TarInfo(os.path.relpath(path, self.save_dir))
+        info.size = len(data)
+        info.mtime = time.time()
+        shard[0].addfile(info, io.BytesIO(data))
+        shard[1] += 1
+
+        # --- Close the shard as soon as it is complete ---
+        if shard[1] == self.files_per_shard:
+            shard[0].close()
+            del self.shards[shard_index]
+
+    def join(self):
+        super().join()
+        for shard, _ in self.shards.values():
+            shard.close()
+        self.shards.clear()
+
+
+def save_image(save_dir, image_index, color_image, depth_image, writer=None, color_ext=".jpg"):
     """
     Save RGB and Depth images to disk with zero-padded filenames.
 
@@ -38,6 +99,9 @@ def save_image(save_dir, image_index, color_image, depth_image):
         image_index (int): Current image index.
         color_image (ndarray): RGB image array.
         depth_image (ndarray): Depth image array.
+        writer (ImageWriter, optional): Background writer to queue the images on.
+            If None, images are written synchronously.
+        color_ext (str): File extension of the color image, ".jpg" or ".png".
 
     Returns:
         None
@@ -47,19 +111,25 @@ def save_image(save_dir, image_index, color_image, depth_image):
         - Prints the saved file paths to the console.
     """
     # --- Generate file paths ---
-    color_path = os.path.join(save_dir, "color", f"color_{image_index:03d}.png")
+    color_path = os.path.join(save_dir, "color", f"color_{image_index:03d}{color_ext}")
     depth_path = os.path.join(save_dir, "depth", f"depth_{image_index:03d}.png")
+    color_params = COLOR_PNG_PARAMS if color_ext == ".png" else COLOR_JPEG_PARAMS
 
     # --- Write images to disk ---
-    cv2.imwrite(color_path, color_image)
-    cv2.imwrite(depth_path, depth_image)
+    if writer is not None:
+        writer.submit(color_path, color_image, color_params)
+        writer.submit(depth_path, depth_image, DEPTH_PNG_PARAMS)
+    else:
+        imwrite(color_path, color_image, color_params)
+        imwrite(depth_path, depth_image, DEPTH_PNG_PARAMS)
 
     # --- Print saved file info ---
     print(f"[{image_index}] Saved color image to {color_path}")
     print(f"[{image_index}] Saved depth image to {depth_path}")
 
 
-def capture_rgbd_images(full_save_dir, num_images=100, interval=1.0, capture_mode="automatic"):
+def capture_rgbd_images(full_save_dir, num_images=100, interval=1.0, capture_mode="automatic", color_ext=".jpg",
+                        show_preview=True, preview_fps=10.0, shard_size=0, max_depth=None):
     """
     Capture RGB-D images from Intel RealSense camera, supporting manual or automatic modes.
 
@@ -68,21 +138,34 @@ def capture_rgbd_images(full_save_dir, num_images=100, interval=1.0, capture_mod
         num_images (int): Total number of images to capture.
         interval (float): Time interval (in seconds) between captures (only for automatic mode).
         capture_mode (str): "manual" or "automatic".
+        color_ext (str): File extension of saved color images, ".jpg" or ".png".
+        show_preview (bool): Whether to show the live preview window. Manual mode needs it
+                             to receive key presses.
+        preview_fps (float): Maximum refresh rate of the preview window.
+        shard_size (int): If > 0, stream images into tar shards of this many captures
+                          instead of writing individual files (see TarShardWriter).
+        max_depth (float, optional): If set, depth beyond this distance (in meters) is set
+                                     to 0 by librealsense's threshold filter before saving.
 
     Returns:
         None
 
     Side Effects:
-        - Creates 'color' and 'depth' subdirectories under `full_save_dir`.
+        - Creates 'color' and 'depth' subdirectories under `full_save_dir`
+          (or 'shard_XXX.tar' files containing them when `shard_size` > 0).
         - Saves captured RGB and Depth images to disk.
-        - Displays a live preview window showing the current and last captured images.
+        - Displays a live preview window showing the current and last captured images
+          (unless `show_preview` is False).
         - Prints each saved file path to the console.
         - Stops the camera stream and closes OpenCV windows on exit.
     """
 
     # --- Create directories for saving ---
-    os.makedirs(os.path.join(full_save_dir, "color"), exist_ok=True)
-    os.makedirs(os.path.join(full_save_dir, "depth"), exist_ok=True)
+    if shard_size > 0:
+        os.makedirs(full_save_dir, exist_ok=True)
+    else:
+        os.makedirs(os.path.join(full_save_dir, "color"), exist_ok=True)
+        os.makedirs(os.path.join(full_save_dir, "depth"), exist_ok=True)
 
     # --- Initialize RealSense pipeline ---
     pipeline = rs.pipeline()
@@ -90,12 +173,24 @@ def capture_rgbd_images(full_save_dir, num_images=100, interval=1.0, capture_mod
     config.enable_stream(rs.stream.color, 1920, 1080, rs.format.bgr8, 30)
     config.enable_stream(rs.stream.depth, 848, 480, rs.format.z16, 30)
 
-    previous_color_image = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    # --- Optional depth range clipping, done by librealsense instead of in Python ---
+    depth_filter = rs.threshold_filter(0.1, max_depth) if max_depth else None
+
+    # Preview canvas (Left: live | Right: last shot), allocated on the first preview
+    # and then updated in place; never allocated when running without preview
+    preview_frame = None
 
     # --- Start streaming ---
     pipeline.start(config)
+    if shard_size > 0:
+        writer = TarShardWriter(full_save_dir, captures_per_shard=shard_size)
+    else:
+        writer = ImageWriter()
     max_display_width = 1680
 
+    preview_interval = 1.0 / preview_fps
+    last_preview_timestamp = 0
+
     image_index = 0
     last_capture_timestamp = 0
 
@@ -110,34 +205,59 @@ def capture_rgbd_images(full_save_dir, num_images=100, interval=1.0, capture_mod
             if not color_frame or not depth_frame:
                 continue
 
-            color_image = np.asanyarray(color_frame.get_data())
-            depth_image = np.asanyarray(depth_frame.get_data())
-
-            # --- Prepare preview frame ---
-            preview_frame = np.hstack((color_image, previous_color_image))
-            if preview_frame.shape[1] > max_display_width:
-                scale = max_display_width / preview_frame.shape[1]
-                resized_preview = cv2.resize(preview_frame, (0, 0), fx=scale, fy=scale)
-            else:
-                resized_preview = preview_frame
-
-            cv2.imshow("Realsense Capture (Left: Live | Right: Last Shot)", resized_preview)
-            key = cv2.waitKey(1) & 0xFF
+            if depth_filter is not None:
+                depth_frame = depth_filter.process(depth_frame).as_depth_frame()
+
+            # Zero-copy, read-only views of the frame buffers; only valid while the frames are alive
+            # (save_image copies before queueing, the preview copies into its canvas)
+            color_image = np.frombuffer(color_frame.get_data(), dtype=np.uint8).reshape(
+                color_frame.get_height(), color_frame.get_width(), 3)
+            depth_image = np.frombuffer(depth_frame.get_data(), dtype=np.uint16).reshape(
+                depth_frame.get_height(), depth_frame.get_width())
+
+            # --- Update preview (throttled to preview_fps) ---
+            if show_preview and time.monotonic() - last_preview_timestamp >= preview_interval:
+                last_preview_timestamp = time.monotonic()
+                if preview_frame is None:
+                    height, width = color_image.shape[:2]
+                    preview_frame = np.zeros((height, width * 2, 3), dtype=np.uint8)
+                    live_view = preview_frame[:, :width]
+                    last_shot_view = preview_frame[:, width:]
+
+                    # Display size is fixed by the canvas, so compute it once (None = no resize)
+                    display_size = None
+                    if preview_frame.shape[1] > max_display_width:
+                        scale = max_display_width / preview_frame.shape[1]
+                        display_size = (max_display_width, int(preview_frame.shape[0] * scale))
+
+                np.copyto(live_view, color_image)
+                if display_size is not None:
+                    resized_preview = cv2.resize(preview_frame, display_size, interpolation=cv2.INTER_NEAREST)
+                else:
+                    resized_preview = preview_frame
+
+                cv2.imshow("Realsense Capture (Left: Live | Right: Last Shot)", resized_preview)
+
+            # Keys can only be read while a window is open; headless runs stop with Ctrl+C.
+            # pollKey doesn't block, the loop is already paced by the incoming frames
+            key = cv2.pollKey() & 0xFF if show_preview else 0xFF
 
             # --- Handle capture mode ---
             if capture_mode == "manual":
                 # Manual capture: press SPACE to save
                 if key == ord(' '):
-                    save_image(full_save_dir, image_index, color_image, depth_image)
-                    previous_color_image = color_image.copy()
+                    save_image(full_save_dir, image_index, color_image, depth_image, writer, color_ext)
+                    if preview_frame is not None:
+                        np.copyto(last_shot_view, color_image)
                     image_index += 1
             else:
                 # Automatic capture at fixed intervals
                 current_timestamp = time.time()
                 if current_timestamp - last_capture_timestamp >= interval:
-                    save_image(full_save_dir, image_index, color_image, depth_image)
+                    save_image(full_save_dir, image_index, color_image, depth_image, writer, color_ext)
                     last_capture_timestamp = current_timestamp
-                    previous_color_image = color_image.copy()
+                    if preview_frame is not None:
+                        np.copyto(last_shot_view, color_image)
                     image_index += 1
 
             # --- Quit condition ---
@@ -145,8 +265,9 @@ def capture_rgbd_images(full_save_dir, num_images=100, interval=1.0, capture_mod
                 break
 
     finally:
-        # --- Stop streaming and close windows ---
+        # --- Stop streaming, flush pending writes and close windows ---
         pipeline.stop()
+        writer.join()
         cv2.destroyAllWindows()
 
 
@@ -172,6 +293,30 @@ if __name__ == "__main__":
         default=3.0,
         help="Time interval between captures in seconds (default: 3.0)"
     )
+    parser.add_argument(
+        "--color_ext",
+        choices=[".jpg", ".png"],
+        default=".jpg",
+        help="File format of saved color images (default: .jpg)"
+    )
+    parser.add_argument(
+        "--no_preview",
+        action="store_true",
+        help="Run headless without the preview window (automatic mode only)"
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=0,
+        help="Write captures into tar shards of this many captures (color + depth each) instead of separate files; "
+             "extract them before running COLMAP (default: 0, separate files)"
+    )
+    parser.add_argument(
+        "--max_depth",
+        type=float,
+        default=None,
+        help="Zero out depth beyond this distance in meters, applied by librealsense (default: keep all)"
+    )
 
     # --- Mutually exclusive group: manual or automatic capture mode ---
     mode_group = parser.add_mutually_exclusive_group(required=True)
@@ -191,6 +336,8 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    if args.no_preview and args.capture_mode == "manual":
+        parser.error("--no_preview requires automatic mode: manual capture needs the preview window for key input")
 
     # --- Generate a unique save directory ---
     dataset_save_path = get_save_dir(args.save_dir)
@@ -206,5 +353,9 @@ if __name__ == "__main__":
         os.path.join("../datasets", dataset_save_path),
         args.num_images,
         args.interval,
-        args.capture_mode
+        args.capture_mode,
+        args.color_ext,
+        show_preview=not args.no_preview,
+        shard_size=args.shard_size,
+        max_depth=args.max_depth
     )
@@ -0,0 +1,147 @@
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+try:
+    import pyspng  # optional, faster encoder for 16-bit depth PNGs
+except ImportError:
+    pyspng = None
+if pyspng is not None and not hasattr(pyspng, "encode"):
+    pyspng = None  # NVlabs' pyspng shares the module name but can only decode
+
+
+# --- Encoder settings ---
+# Color is stored as JPEG (much cheaper to encode than PNG); depth must stay lossless,
+# so it is stored as PNG with the fastest compression level. Run-length strategy suits
+# depth maps, which contain large zero (invalid) regions.
+COLOR_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 92]
+COLOR_PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+DEPTH_PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE]
+
+
+def encode_image(path, image, params=()):
+    """
+    Encode an image in memory, in the format given by the extension of `path`.
+
+    Single-channel 16-bit PNGs (depth maps) are encoded with pyspng when it is
+    installed, which is considerably faster than libpng through OpenCV. If pyspng
+    fails, and for everything else, cv2.imencode is used with the given encoder params.
+
+    Returns:
+        bytes: The encoded file contents, or None if encoding failed.
+    """
+    if pyspng is not None and image.dtype == np.uint16 and image.ndim == 2 and path.endswith(".png"):
+        try:
+            return pyspng.encode(image, progressive=pyspng.ProgressiveMode.NONE, compress_level=1)
+        except Exception:
+            pass  # fall back to OpenCV below
+
+    ok, buffer = cv2.imencode(os.path.splitext(path)[1], image, list(params))
+    return buffer.tobytes() if ok else None
+
+
+def imwrite(path, image, params=()):
+    """
+    Encode an image and write it to disk with a single write call.
+
+    Returns:
+        bool: True if the image was written successfully.
+    """
+    data = encode_image(path, image, params)
+    if data is None:
+        return False
+
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+class ImageWriter:
+    """
+    Write images to disk on background threads.
+
+    Encoding is the most expensive step of a capture, so it runs on a pool of encoder
+    threads (cv2.imencode releases the GIL while it compresses). The encoded bytes are
+    handed to a single writer thread that only copies them to disk, which keeps disk
+    access sequential and lets the capture thread grab the next frame right away.
+
+    Args:
+        num_workers (int): Number of encoder threads (default: half the CPU count).
+        max_pending (int): Maximum number of queued images before submit() blocks.
+    """
+
+    def __init__(self, num_workers=None, max_pending=32):
+        if num_workers is None:
+            num_workers = max(1, (os.cpu_count() or 2) // 2)
+
+        self.encode_queue = queue.Queue(maxsize=max_pending)
+        self.write_queue = queue.Queue(maxsize=max_pending)
+        self.encoders = [
+            threading.Thread(target=self._encode_loop, daemon=True)
+            for _ in range(num_workers)
+        ]
+        self.disk_writer = threading.Thread(target=self._write_loop, daemon=True)
+
+        for encoder in self.encoders:
+            encoder.start()
+        self.disk_writer.start()
+
+    def _encode_loop(self):
+        while True:
+            item = self.encode_queue.get()
+            if item is None:
+                break
+
+            path, image, params = item
+            try:
+                data = encode_image(path, image, params)
+            except Exception as e:
+                # Keep the thread alive: a dead encoder would leave submit() and join() blocked
+                print(f"Failed to encode image: {path} ({e})")
+                continue
+            if data is None:
+                print(f"Failed to encode image: {path}")
+                continue
+            self.write_queue.put((path, data))
+
+    def _write_loop(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+
+            path, data = item
+            try:
+                self.write_bytes(path, data)
+            except Exception as e:
+                # e.g. disk full; report it and keep draining the queue
+                print(f"Failed to write image: {path} ({e})")
+
+    def write_bytes(self, path, data):
+        """
+        Store one encoded image. Called from the writer thread only.
+        """
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def submit(self, path, image, params=()):
+        """
+        Queue an image for writing. The image is copied, so the caller may reuse
+        or release its buffer (e.g. a RealSense frame) right away.
+        """
+        self.encode_queue.put((path, image.copy(), list(params)))
+
+    def join(self):
+        """
+        Wait for all queued images to be written and stop the worker threads.
+        """
+        for _ in self.encoders:
+            self.encode_queue.put(None)
+        for encoder in self.encoders:
+            encoder.join()
+
+        self.write_queue.put(None)
+        self.disk_writer.join()
@@ -4,38 +4,50 @@ import os
 # 数据库路径
 db_path = "database.db"  # 替换成你的 database.db 路径
 
+# COLMAP 用 pair_id = image_id1 * MAX_IMAGE_ID + image_id2 编码图像对
+MAX_IMAGE_ID = 2147483647
+
 if not os.path.exists(db_path):
     print("数据库文件不存在:", db_path)
     exit(1)
 
-conn = sqlite3.connect(db_path)
+# 只读方式打开，避免修改 COLMAP 数据库
+conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+conn.execute("PRAGMA cache_size = -65536")  # 64 MB 页缓存
+conn.execute("PRAGMA temp_store = MEMORY")  # GROUP BY / DISTINCT 的临时表放在内存
 cursor = conn.cursor()
 
-# 查询每张图像的特征点数量
+# 查询每张图像的特征点数量（keypoints 表每张图像一行，rows 即特征点数）
 cursor.execute("""
-    SELECT name, rows
+    SELECT images.name, keypoints.rows
     FROM images
-    JOIN (SELECT image_id, COUNT(*) AS rows FROM keypoints GROUP BY image_id) AS kp
-    ON images.image_id = kp.image_id
+    JOIN keypoints ON images.image_id = keypoints.image_id
 """)
-features = cursor.fetchall()
 
 print("每张图像的特征点数量：")
-for name, count in features:
+for name, count in cursor:  # 逐行读取，不一次性 fetchall
     print(f"{name}: {count} 特征点")
 
-# 查询每张图像匹配到多少张其他图片
-cursor.execute("""
-    SELECT im1.name, COUNT(DISTINCT im2.id) as matched_images
-    FROM matches AS m
-    JOIN images AS im1 ON m.image_id1 = im1.image_id
-    JOIN images AS im2 ON m.image_id2 = im2.image_id
-    GROUP BY im1.name
+# 查询每张图像匹配到多少张其他图片（从 pair_id 解码出两张图像，双向统计）
+cursor.execute(f"""
+    WITH pairs AS (
+        SELECT pair_id / {MAX_IMAGE_ID} AS image_id1, pair_id % {MAX_IMAGE_ID} AS image_id2
+        FROM matches
+        WHERE rows > 0
+    ),
+    image_pairs AS (
+        SELECT image_id1 AS image_id, image_id2 AS other_id FROM pairs
+        UNION ALL
+        SELECT image_id2 AS image_id, image_id1 AS other_id FROM pairs
+    )
+    SELECT images.name, COUNT(DISTINCT image_pairs.other_id) AS matched_images
+    FROM image_pairs
+    JOIN images ON image_pairs.image_id = images.image_id
+    GROUP BY images.name
 """)
-matches = cursor.fetchall()
 
 print("\n每张图像匹配到的其他图片数：")
-for name, matched_count in matches:
+for name, matched_count in cursor:
     print(f"{name}: {matched_count} 张图片匹配")
-    
+
 conn.close()
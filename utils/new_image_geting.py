@@ -4,6 +4,15 @@ import cv2
 import os
 import argparse
 import time
+import queue
+import threading
+
+from image_io import COLOR_JPEG_PARAMS, COLOR_PNG_PARAMS, DEPTH_PNG_PARAMS, ImageWriter, imwrite
+
+
+# HSV range of the green area kept by the color mask
+LOWER_GREEN = np.array([35, 40, 40], dtype=np.uint8)
+UPPER_GREEN = np.array([85, 255, 255], dtype=np.uint8)
 
 
 def get_save_dir(base_dir="realsense_capture"):
@@ -17,65 +26,125 @@ def get_save_dir(base_dir="realsense_capture"):
         i += 1
 
 
-def save_image(save_dir, image_index, color_image, depth_image):
+def write_image(path, image, writer=None, params=()):
+    if writer is not None:
+        writer.submit(path, image, params)
+    else:
+        imwrite(path, image, params)
+
+
+def save_image(save_dir, image_index, color_image, depth_image, writer=None, color_ext=".jpg"):
     os.makedirs(os.path.join(save_dir, "color"), exist_ok=True)
     os.makedirs(os.path.join(save_dir, "depth"), exist_ok=True)
 
-    color_path = os.path.join(save_dir, "color", f"color_{image_index:03d}.png")
+    color_path = os.path.join(save_dir, "color", f"color_{image_index:03d}{color_ext}")
     depth_path = os.path.join(save_dir, "depth", f"depth_{image_index:03d}.png")
+    color_params = COLOR_PNG_PARAMS if color_ext == ".png" else COLOR_JPEG_PARAMS
 
-    cv2.imwrite(color_path, color_image)
-    cv2.imwrite(depth_path, depth_image)
+    write_image(color_path, color_image, writer, color_params)
+    write_image(depth_path, depth_image, writer, DEPTH_PNG_PARAMS)
 
     print(f"[{image_index}] Saved color image to {color_path}")
     print(f"[{image_index}] Saved depth image to {depth_path}")
 
 
-def save_rgbd_with_mask(save_dir, image_index, color_image, depth_image, depth_threshold=2000):
-    # --- Ensure folders ---
+def save_rgbd_with_mask(save_dir, image_index, color_image, depth_image, depth_threshold=2000, writer=None,
+                        color_ext=".jpg"):
+    # --- Output folders (created once by capture_rgbd_images) ---
     raw_color_dir = os.path.join(save_dir, "raw_color")
     raw_depth_dir = os.path.join(save_dir, "raw_depth")
     mask_color_dir = os.path.join(save_dir, "mask_color")
     mask_depth_dir = os.path.join(save_dir, "mask_depth")
-    os.makedirs(raw_color_dir, exist_ok=True)
-    os.makedirs(raw_depth_dir, exist_ok=True)
-    os.makedirs(mask_color_dir, exist_ok=True)
-    os.makedirs(mask_depth_dir, exist_ok=True)
 
     # --- Save raw images ---
-    raw_color_path = os.path.join(raw_color_dir, f"color_{image_index:03d}.png")
+    color_params = COLOR_PNG_PARAMS if color_ext == ".png" else COLOR_JPEG_PARAMS
+    raw_color_path = os.path.join(raw_color_dir, f"color_{image_index:03d}{color_ext}")
     raw_depth_path = os.path.join(raw_depth_dir, f"depth_{image_index:03d}.png")
-    cv2.imwrite(raw_color_path, color_image)
-    cv2.imwrite(raw_depth_path, depth_image)
+    write_image(raw_color_path, color_image, writer, color_params)
+    write_image(raw_depth_path, depth_image, writer, DEPTH_PNG_PARAMS)
 
     # --- Depth filtering ---
-    depth_mask = (depth_image < depth_threshold)
-    depth_mask = depth_mask.astype(np.uint8) * 255
+    # UMat lets OpenCV run the per-pixel ops through OpenCL when a device is available.
+    # compare yields the 0/255 uint8 mask directly (depth < depth_threshold)
+    depth_umat = cv2.UMat(depth_image)
+    depth_mask = cv2.compare(depth_umat, depth_threshold, cv2.CMP_LT)
 
     # --- Color filtering (green area) ---
-    hsv = cv2.cvtColor(color_image, cv2.COLOR_BGR2HSV)
-    lower_green = np.array([35, 40, 40])
-    upper_green = np.array([85, 255, 255])
-    color_mask = cv2.inRange(hsv, lower_green, upper_green)
+    color_umat = cv2.UMat(color_image)
+    hsv = cv2.cvtColor(color_umat, cv2.COLOR_BGR2HSV)
+    color_mask = cv2.inRange(hsv, LOWER_GREEN, UPPER_GREEN)
 
     # --- Combine depth and color masks ---
     combined_mask = cv2.bitwise_and(depth_mask, color_mask)
 
     # --- Apply mask to images ---
-    color_masked = cv2.bitwise_and(color_image, color_image, mask=combined_mask)
-    depth_masked = cv2.bitwise_and(depth_image, depth_image, mask=combined_mask)
+    color_masked = cv2.bitwise_and(color_umat, color_umat, mask=combined_mask).get()
+    depth_masked = cv2.bitwise_and(depth_umat, depth_umat, mask=combined_mask).get()
 
     # --- Save masked results ---
-    mask_color_path = os.path.join(mask_color_dir, f"color_{image_index:03d}.png")
+    mask_color_path = os.path.join(mask_color_dir, f"color_{image_index:03d}{color_ext}")
     mask_depth_path = os.path.join(mask_depth_dir, f"depth_{image_index:03d}.png")
-    cv2.imwrite(mask_color_path, color_masked)
-    cv2.imwrite(mask_depth_path, depth_masked)
+    write_image(mask_color_path, color_masked, writer, color_params)
+    write_image(mask_depth_path, depth_masked, writer, DEPTH_PNG_PARAMS)
 
     print(f"[{image_index}] Raw images saved to {raw_color_path}, {raw_depth_path}")
     print(f"[{image_index}] Masked images saved to {mask_color_path}, {mask_depth_path}")
 
 
-def capture_rgbd_images(full_save_dir, num_images=1000, interval=2.0, capture_mode="automatic"):
+def make_depth_colormap_lut(alpha=0.03):
+    # uint16 depth -> BGR table, same result as applyColorMap(convertScaleAbs(depth, alpha), JET)
+    scaled = np.clip(np.rint(np.arange(65536, dtype=np.float32) * alpha), 0, 255).astype(np.uint8)
+    jet = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET).reshape(256, 3)
+    return jet[scaled]
+
+
+DEPTH_COLORMAP_LUT = make_depth_colormap_lut()
+
+
+def colorize_depth(depth_image):
+    # Depth colormap for visualization (single table lookup per pixel)
+    return DEPTH_COLORMAP_LUT[depth_image]
+
+
+def grab_frames(pipeline, align, frame_queue, stop_event, depth_filter=None):
+    # Capture stage: runs on its own thread so waiting for and aligning frames overlaps
+    # with the preview/mask work on the main thread. If the consumer falls behind, the
+    # oldest queued frame is dropped so the preview always shows the latest one.
+    while not stop_event.is_set():
+        frames = pipeline.wait_for_frames()
+        aligned_frames = align.process(frames)
+        color_frame = aligned_frames.get_color_frame()
+        depth_frame = aligned_frames.get_depth_frame()
+
+        if not color_frame or not depth_frame:
+            continue
+
+        # Optional in-SDK depth clipping (out-of-range pixels are set to 0)
+        if depth_filter is not None:
+            depth_frame = depth_filter.process(depth_frame).as_depth_frame()
+
+        # Copy out of the zero-copy buffer views so the RealSense frames are handed back to the SDK right away
+        color_image = np.frombuffer(color_frame.get_data(), dtype=np.uint8).reshape(
+            color_frame.get_height(), color_frame.get_width(), 3).copy()
+        depth_image = np.frombuffer(depth_frame.get_data(), dtype=np.uint16).reshape(
+            depth_frame.get_height(), depth_frame.get_width()).copy()
+
+        try:
+            frame_queue.put_nowait((color_image, depth_image))
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            frame_queue.put_nowait((color_image, depth_image))
+
+
+def capture_rgbd_images(full_save_dir, num_images=1000, interval=2.0, capture_mode="automatic", color_ext=".jpg",
+                        show_preview=True, preview_fps=10.0, max_depth=None):
+    # --- Create directories for saving ---
+    for sub_dir in ("raw_color", "raw_depth", "mask_color", "mask_depth"):
+        os.makedirs(os.path.join(full_save_dir, sub_dir), exist_ok=True)
+
     # --- Initialize RealSense pipeline ---
     pipeline = rs.pipeline()
     config = rs.config()
@@ -84,79 +153,101 @@ def capture_rgbd_images(full_save_dir, num_images=1000, interval=2.0, capture_mo
 
     # --- Start streaming ---
     profile = pipeline.start(config)
+    writer = ImageWriter()
 
     # --- Align depth to color ---
     align_to = rs.stream.color
     align = rs.align(align_to)
 
-    # Store previous captured RGB and Depth (start as black images)
-    previous_color = np.zeros((720, 1280, 3), dtype=np.uint8)
-    previous_depth_colormap = np.zeros((720, 1280, 3), dtype=np.uint8)
+    # --- Optional depth range clipping, done by librealsense instead of in Python ---
+    depth_filter = rs.threshold_filter(0.1, max_depth) if max_depth else None
+
+    # Preview canvas, allocated on the first preview and then updated in place:
+    # Left = current, Right = previous captured; Top = RGB, Bottom = Depth (previous starts black)
+    preview_frame = None
 
     max_display_width = 1680
+    preview_interval = 1.0 / preview_fps
+    last_preview_timestamp = 0
     image_index = 0
     last_capture_timestamp = 0
 
+    # --- Start capture stage ---
+    frame_queue = queue.Queue(maxsize=2)
+    stop_event = threading.Event()
+    grabber = threading.Thread(target=grab_frames, args=(pipeline, align, frame_queue, stop_event, depth_filter), daemon=True)
+    grabber.start()
+
     try:
         while image_index < num_images:
-            frames = pipeline.wait_for_frames()
-            aligned_frames = align.process(frames)
-            color_frame = aligned_frames.get_color_frame()
-            depth_frame = aligned_frames.get_depth_frame()
-
-            if not color_frame or not depth_frame:
+            try:
+                color_image, depth_image = frame_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not grabber.is_alive():  # capture thread failed (e.g. camera disconnected)
+                    break
                 continue
 
-            # Convert to numpy arrays
-            color_image = np.asanyarray(color_frame.get_data())
-            depth_image = np.asanyarray(depth_frame.get_data())
-
-            # Depth colormap for visualization
-            depth_colormap = cv2.applyColorMap(
-                cv2.convertScaleAbs(depth_image, alpha=0.03),
-                cv2.COLORMAP_JET
-            )
-
-            # --- Combine current RGB+Depth vertically ---
-            current_pair = np.vstack((color_image, depth_colormap))
-
-            # --- Combine previous RGB+Depth vertically ---
-            previous_pair = np.vstack((previous_color, previous_depth_colormap))
-
-            # --- Final preview: Left = current, Right = previous ---
-            preview_frame = np.hstack((current_pair, previous_pair))
-
-            # Resize if too wide
-            if preview_frame.shape[1] > max_display_width:
-                scale = max_display_width / preview_frame.shape[1]
-                resized_preview = cv2.resize(preview_frame, (0, 0), fx=scale, fy=scale)
-            else:
-                resized_preview = preview_frame
-
-            cv2.imshow("Realsense Capture (Top: RGB | Bottom: Depth)", resized_preview)
-            key = cv2.waitKey(1) & 0xFF
+            # --- Update preview (throttled to preview_fps) ---
+            if show_preview and time.monotonic() - last_preview_timestamp >= preview_interval:
+                last_preview_timestamp = time.monotonic()
+                if preview_frame is None:
+                    height, width = color_image.shape[:2]
+                    preview_frame = np.zeros((height * 2, width * 2, 3), dtype=np.uint8)
+                    current_color_view = preview_frame[:height, :width]
+                    current_depth_view = preview_frame[height:, :width]
+                    previous_color_view = preview_frame[:height, width:]
+                    previous_depth_view = preview_frame[height:, width:]
+
+                    # Display size is fixed by the canvas, so compute it once (None = no resize)
+                    display_size = None
+                    if preview_frame.shape[1] > max_display_width:
+                        scale = max_display_width / preview_frame.shape[1]
+                        display_size = (max_display_width, int(preview_frame.shape[0] * scale))
+
+                # Update current RGB+Depth in the preview canvas
+                np.copyto(current_color_view, color_image)
+                np.copyto(current_depth_view, colorize_depth(depth_image))
+
+                # Resize if too wide
+                if display_size is not None:
+                    resized_preview = cv2.resize(preview_frame, display_size, interpolation=cv2.INTER_NEAREST)
+                else:
+                    resized_preview = preview_frame
+
+                cv2.imshow("Realsense Capture (Top: RGB | Bottom: Depth)", resized_preview)
+
+            # Keys can only be read while a window is open; headless runs stop with Ctrl+C.
+            # pollKey doesn't block, the loop is already paced by the incoming frames
+            key = cv2.pollKey() & 0xFF if show_preview else 0xFF
 
             # --- Handle capture mode ---
             if capture_mode == "manual":
                 if key == ord(' '):  # SPACE to save
-                    save_rgbd_with_mask(full_save_dir, image_index, color_image, depth_image)
-                    previous_color = color_image.copy()
-                    previous_depth_colormap = depth_colormap.copy()
+                    save_rgbd_with_mask(full_save_dir, image_index, color_image, depth_image,
+                                        writer=writer, color_ext=color_ext)
+                    if preview_frame is not None:
+                        np.copyto(previous_color_view, color_image)
+                        np.copyto(previous_depth_view, colorize_depth(depth_image))
                     image_index += 1
             else:  # automatic
                 current_timestamp = time.time()
                 if current_timestamp - last_capture_timestamp >= interval:
-                    save_rgbd_with_mask(full_save_dir, image_index, color_image, depth_image)
+                    save_rgbd_with_mask(full_save_dir, image_index, color_image, depth_image,
+                                        writer=writer, color_ext=color_ext)
                     last_capture_timestamp = current_timestamp
-                    previous_color = color_image.copy()
-                    previous_depth_colormap = depth_colormap.copy()
+                    if preview_frame is not None:
+                        np.copyto(previous_color_view, color_image)
+                        np.copyto(previous_depth_view, colorize_depth(depth_image))
                     image_index += 1
 
             if key == ord('q'):
                 break
 
     finally:
+        stop_event.set()
+        grabber.join()
         pipeline.stop()
+        writer.join()
         cv2.destroyAllWindows()
 
 
@@ -165,6 +256,10 @@ if __name__ == "__main__":
     parser.add_argument("save_dir", nargs="?", default="realsense_capture", help="Directory to save images")
     parser.add_argument("num_images", nargs="?", type=int, default=1000, help="Number of images to capture")
     parser.add_argument("-i", "--interval", type=float, default=2.0, help="Interval between captures in seconds")
+    parser.add_argument("--color_ext", choices=[".jpg", ".png"], default=".jpg", help="File format of saved color images")
+    parser.add_argument("--no_preview", action="store_true", help="Run headless without the preview window (automatic mode only)")
+    parser.add_argument("--max_depth", type=float, default=None,
+                        help="Zero out depth beyond this distance in meters (applied by librealsense)")
 
     mode_group = parser.add_mutually_exclusive_group(required=True)
     mode_group.add_argument("-m", "--manual", action="store_const", const="manual", dest="capture_mode",
@@ -173,6 +268,8 @@ if __name__ == "__main__":
                             help="Automatic mode: capture at fixed intervals")
 
     args = parser.parse_args()
+    if args.no_preview and args.capture_mode == "manual":
+        parser.error("--no_preview requires automatic mode: manual capture needs the preview window for key input")
     dataset_save_path = get_save_dir(args.save_dir)
 
     print(f"Saving data to folder: {dataset_save_path}")
@@ -185,5 +282,8 @@ if __name__ == "__main__":
         os.path.join("../datasets", dataset_save_path),
         args.num_images,
         args.interval,
-        args.capture_mode
+        args.capture_mode,
+        args.color_ext,
+        show_preview=not args.no_preview,
+        max_depth=args.max_depth
     )
@@ -1,39 +1,44 @@
 import open3d as o3d
-import numpy as np
-import cv2
 
 # 设置相机内参（根据你的相机调整）
 width, height = 640, 480
 fx, fy = 525.0, 525.0  # 焦距
 cx, cy = width / 2, height / 2
 
-intrinsic = o3d.camera.PinholeCameraIntrinsic(width, height, fx, fy, cx, cy)
+intrinsic = o3d.core.Tensor([[fx, 0, cx],
+                             [0, fy, cy],
+                             [0, 0, 1]], dtype=o3d.core.Dtype.Float64)
+
+# 坐标系调整：翻转 Y/Z 轴（作为外参传入，投影时一并完成）
+flip_axes = o3d.core.Tensor([[1, 0, 0, 0],
+                             [0, -1, 0, 0],
+                             [0, 0, -1, 0],
+                             [0, 0, 0, 1]], dtype=o3d.core.Dtype.Float64)
+
+# 计算设备：有 CUDA 时使用 GPU，否则使用 CPU
+device = o3d.core.Device("CUDA:0") if o3d.core.cuda.is_available() else o3d.core.Device("CPU:0")
 
 # RGB 和 Depth 文件路径
 rgb_path = "color_002.png"
 depth_path = "depth_002.png"
 
-# 读取图像
-color = o3d.io.read_image(rgb_path)
-depth = o3d.io.read_image(depth_path)
+# 读取图像并拷贝到计算设备
+color = o3d.t.io.read_image(rgb_path).to(device)
+depth = o3d.t.io.read_image(depth_path).to(device)
 
 # 创建 RGBD 图像
-rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
-    color, depth, convert_rgb_to_intensity=False
-)
+rgbd_image = o3d.t.geometry.RGBDImage(color, depth)
 
-# 从 RGBD 图像生成点云
-pcd = o3d.geometry.PointCloud.create_from_rgbd_image(rgbd_image, intrinsic)
-
-# 可选：调整坐标系
-pcd.transform([[1, 0, 0, 0],
-               [0, -1, 0, 0],
-               [0, 0, -1, 0],
-               [0, 0, 0, 1]])
+# 从 RGBD 图像生成点云：RealSense 的有效深度约为 0.3 ~ 5 米，超过 5 米的点在投影时直接截断
+pcd = o3d.t.geometry.PointCloud.create_from_rgbd_image(
+    rgbd_image, intrinsic, extrinsics=flip_axes, depth_scale=1000.0, depth_max=5.0
+)
+# 近处下限 Open3D 不支持，按翻转后的 z 在设备上筛掉 0.3 米以内的点
+pcd = pcd.select_by_mask(pcd.point.positions[:, 2] < -0.3)
 
 # 可视化
-o3d.visualization.draw_geometries([pcd])
+o3d.visualization.draw_geometries([pcd.to_legacy()])
 
 # 保存点云
-o3d.io.write_point_cloud("output.ply", pcd)
+o3d.t.io.write_point_cloud("output.ply", pcd.cpu(), write_ascii=False, compressed=True, print_progress=False)
 print("点云已保存为 output.ply")
@@ -1,49 +1,266 @@
+import argparse
 import open3d as o3d
 import cv2
 import numpy as np
 
-# 路径设置
-rgb_path = "color_002.png"
-depth_path = "depth_002.png"
-
-# 读取深度图
-depth = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)  # 保留原始深度
-height, width = depth.shape
-
-# 读取 RGB 图像并缩放到深度图大小
-color = cv2.imread(rgb_path)
-color = cv2.resize(color, (width, height))
-color = cv2.cvtColor(color, cv2.COLOR_BGR2RGB)
-
-# 转换为 Open3D 图像
-color_o3d = o3d.geometry.Image(color)
-depth_o3d = o3d.geometry.Image(depth)
-
-# 相机内参设置（根据深度图分辨率）
-fx, fy = 525.0, 525.0  # 焦距，可根据相机调整
-cx, cy = width / 2, height / 2
-intrinsic = o3d.camera.PinholeCameraIntrinsic(width, height, fx, fy, cx, cy)
-
-# 创建 RGBD 图像
-rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
-    color_o3d,
-    depth_o3d,
-    depth_scale=1000.0,   # 如果深度图单位是毫米
-    convert_rgb_to_intensity=False
-)
-
-# 从 RGBD 图像生成点云
-pcd = o3d.geometry.PointCloud.create_from_rgbd_image(rgbd_image, intrinsic)
-
-# 坐标系调整（可选）
-pcd.transform([[1, 0, 0, 0],
-               [0, -1, 0, 0],
-               [0, 0, -1, 0],
-               [0, 0, 0, 1]])
-
-# 可视化点云
-o3d.visualization.draw_geometries([pcd])
-
-# 保存点云
-o3d.io.write_point_cloud("output.ply", pcd)
-print("点云已保存为 output.ply")
+try:
+    from numba import njit, prange
+except ImportError:  # 未安装 numba 时使用 NumPy 实现
+    njit, prange = None, range
+
+
+# 像素射线缓存：(u - cx) / fx 和 (v - cy) / fy 只与分辨率和内参有关，同尺寸的多帧只需计算一次
+_RAY_CACHE = {}
+
+
+def get_pixel_rays(height, width, fx, fy, cx, cy):
+    """返回每列的 (u - cx) / fx 和每行的 (v - cy) / fy（按分辨率和内参缓存）"""
+    key = (height, width, fx, fy, cx, cy)
+    if key not in _RAY_CACHE:
+        ray_x = (np.arange(width, dtype=np.float32) - cx) / fx
+        ray_y = (np.arange(height, dtype=np.float32) - cy) / fy
+        _RAY_CACHE[key] = (ray_x, ray_y)
+    return _RAY_CACHE[key]
+
+
+# 坐标系调整：翻转 Y/Z 轴（OpenCV 相机坐标 -> Open3D 显示习惯），与位姿合并成一个变换在反投影时完成
+FLIP_AXES = np.diag([1.0, -1.0, -1.0, 1.0])
+
+
+def depth_limits(depth_scale, depth_min, depth_trunc):
+    """把米为单位的深度范围换算成原始深度值 (lo, hi)，有效像素满足 lo < d <= hi
+
+    计数和反投影都用这同一个整数比较，保证预先统计的点数与实际写入的点数严格一致
+    """
+    return int(np.floor(depth_min * depth_scale)), int(np.floor(depth_trunc * depth_scale))
+
+
+def count_valid(depth, lo, hi, stride=1):
+    """统计（隔 stride 采样后）有效深度的像素数，用于预先分配输出缓冲区"""
+    depth = depth[::stride, ::stride]
+    return int(np.count_nonzero((depth > lo) & (depth <= hi)))
+
+
+def unproject_numpy(depth, color, ray_x, ray_y, depth_scale, lo, hi, stride, transform, xyz_out, rgb_out):
+    """用 NumPy 反投影有效像素，结果写入 xyz_out (float32) 和 rgb_out (uint8)；
+    transform 为作用在相机坐标上的 4x4 变换，stride > 1 时隔点采样"""
+    # 在原图网格上隔 stride 取样，射线也按同样的位置取
+    depth = depth[::stride, ::stride]
+    color = color[::stride, ::stride]
+    valid = (depth > lo) & (depth <= hi)
+    v, u = np.nonzero(valid)  # 行优先顺序，与逐像素实现一致
+
+    # x = ray_x * z, y = ray_y * z（射线已包含除以焦距，每个像素只剩乘法）
+    z = depth[valid].astype(np.float32) * np.float32(1.0 / depth_scale)
+    xyz = np.stack([ray_x[::stride][u] * z, ray_y[::stride][v] * z, z], axis=-1)
+
+    xyz_out[:] = xyz @ transform[:3, :3].T.astype(np.float32) + transform[:3, 3].astype(np.float32)
+    rgb_out[:] = color[valid]
+
+
+def unproject_loops(depth, color, ray_x, ray_y, depth_scale, lo, hi, stride, transform, xyz_out, rgb_out):
+    """逐像素反投影（由 numba 编译）：先按行统计有效点数算出偏移，再并行写入 xyz_out / rgb_out，
+    一次遍历完成投影、变换和取色"""
+    height, width = depth.shape
+    inv_scale = 1.0 / depth_scale
+    rows = (height + stride - 1) // stride
+
+    # 第一遍：每行（采样后）的有效点数
+    row_counts = np.zeros(rows, dtype=np.int64)
+    for r in prange(rows):
+        v = r * stride
+        count = 0
+        for u in range(0, width, stride):
+            d = depth[v, u]
+            if d > lo and d <= hi:
+                count += 1
+        row_counts[r] = count
+
+    offsets = np.zeros(rows + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(row_counts)
+
+    # 第二遍：各行写入自己的区间，无需原子操作
+    for r in prange(rows):
+        v = r * stride
+        i = offsets[r]
+        for u in range(0, width, stride):
+            d = depth[v, u]
+            if d > lo and d <= hi:
+                z = d * inv_scale
+                x = ray_x[u] * z
+                y = ray_y[v] * z
+                for c in range(3):
+                    xyz_out[i, c] = transform[c, 0] * x + transform[c, 1] * y + transform[c, 2] * z + transform[c, 3]
+                    rgb_out[i, c] = color[v, u, c]
+                i += 1
+
+
+unproject = njit(parallel=True, fastmath=True, cache=True)(unproject_loops) if njit else unproject_numpy
+
+
+def unproject_frame(depth, color, fx, fy, cx, cy, depth_scale, depth_trunc, stride=1, depth_min=0.0, pose=None):
+    """反投影一帧 RGB-D，返回 float32 (N, 3) 坐标和 uint8 (N, 3) 颜色
+
+    pose 为该帧相机到世界的 4x4 位姿（OpenCV 相机坐标系），省略时为单位阵；结果最后再翻转 Y/Z 轴
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be >= 1, got {stride}")
+    lo, hi = depth_limits(depth_scale, depth_min, depth_trunc)
+    n = count_valid(depth, lo, hi, stride)
+    xyz = np.empty((n, 3), dtype=np.float32)
+    rgb = np.empty((n, 3), dtype=np.uint8)
+
+    transform = FLIP_AXES if pose is None else FLIP_AXES @ pose
+    ray_x, ray_y = get_pixel_rays(*depth.shape, fx, fy, cx, cy)
+    unproject(depth, color, ray_x, ray_y, depth_scale, lo, hi, stride, transform, xyz, rgb)
+    return xyz, rgb
+
+
+def unproject_tensor(depth, color, fx, fy, cx, cy, depth_scale, depth_trunc, device, stride=1, depth_min=0.0):
+    """在 Open3D tensor 后端（如 CUDA）上生成点云，Y/Z 翻转作为外参在投影 kernel 中一并完成"""
+    intrinsic = o3d.core.Tensor([[fx, 0, cx],
+                                 [0, fy, cy],
+                                 [0, 0, 1]], dtype=o3d.core.Dtype.Float64)
+    flip_axes = o3d.core.Tensor([[1, 0, 0, 0],
+                                 [0, -1, 0, 0],
+                                 [0, 0, -1, 0],
+                                 [0, 0, 0, 1]], dtype=o3d.core.Dtype.Float64)
+
+    rgbd_image = o3d.t.geometry.RGBDImage(
+        o3d.t.geometry.Image(o3d.core.Tensor(np.ascontiguousarray(color))).to(device),
+        o3d.t.geometry.Image(o3d.core.Tensor(depth)).to(device)
+    )
+    pcd = o3d.t.geometry.PointCloud.create_from_rgbd_image(
+        rgbd_image, intrinsic, extrinsics=flip_axes, depth_scale=depth_scale, depth_max=depth_trunc,
+        stride=stride
+    )
+    # depth_max 在投影时已截断远处的点；近处下限 Open3D 不支持，在设备上按翻转后的 z 再筛一次
+    if depth_min > 0:
+        pcd = pcd.select_by_mask(pcd.point.positions[:, 2] < -depth_min)
+    return pcd
+
+
+def load_depth(depth_path):
+    """读取深度图（支持 16 位 PNG 和 try.py 保存的 .npy）"""
+    if depth_path.endswith(".npy"):
+        return np.load(depth_path)
+    return cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)  # 保留原始深度
+
+
+def load_rgbd(rgb_path, depth_path):
+    """读取一帧 RGB-D，返回原始深度和与之同尺寸的 RGB 图像"""
+    depth = load_depth(depth_path)
+    height, width = depth.shape
+
+    # 读取 RGB 图像，仅在尺寸与深度图不同时才缩放（对齐后的 RealSense 图像尺寸相同）
+    color = cv2.imread(rgb_path, cv2.IMREAD_COLOR)
+    if color.shape[:2] != (height, width):
+        color = cv2.resize(color, (width, height), interpolation=cv2.INTER_AREA)
+    return depth, color[..., ::-1]  # BGR -> RGB，只是视图，不拷贝数据
+
+
+def read_frame_list(list_path):
+    """读取多帧列表：每行为 "rgb_path depth_path [位姿]"，位姿是相机到世界的 4x4 矩阵按行展开的 16 个数，
+    省略时为单位阵；空行和 # 开头的行忽略"""
+    color_paths, depth_paths, poses = [], [], []
+    with open(list_path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            color_paths.append(fields[0])
+            depth_paths.append(fields[1])
+            poses.append(np.array(fields[2:], dtype=np.float64).reshape(4, 4) if len(fields) > 2 else np.eye(4))
+    return color_paths, depth_paths, poses
+
+
+def batch_unproject(depth_paths, color_paths, K, depth_scale, poses, depth_trunc=5.0, stride=1, depth_min=0.3):
+    """把多帧 RGB-D 按各自位姿反投影到同一世界坐标系，合并为一个点云
+
+    K 为 (fx, fy, cx, cy)，poses 为每帧相机到世界的 4x4 位姿。返回连续的 float32 (N, 3) 坐标和 uint8 (N, 3) 颜色
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be >= 1, got {stride}")
+    fx, fy, cx, cy = K
+    lo, hi = depth_limits(depth_scale, depth_min, depth_trunc)
+
+    # 第一遍：只读深度图，统计每帧的有效点数
+    counts = [count_valid(load_depth(depth_path), lo, hi, stride) for depth_path in depth_paths]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # 按总点数一次性分配缓冲区，之后不再扩容
+    xyz_all = np.empty((offsets[-1], 3), dtype=np.float32)
+    rgb_all = np.empty((offsets[-1], 3), dtype=np.uint8)
+
+    # 第二遍：逐帧反投影，直接写入各自的区间
+    for i, (depth_path, rgb_path, pose) in enumerate(zip(depth_paths, color_paths, poses)):
+        depth, color = load_rgbd(rgb_path, depth_path)
+        ray_x, ray_y = get_pixel_rays(*depth.shape, fx, fy, cx, cy)
+        unproject(depth, color, ray_x, ray_y, depth_scale, lo, hi, stride, FLIP_AXES @ pose,
+                  xyz_all[offsets[i]:offsets[i + 1]], rgb_all[offsets[i]:offsets[i + 1]])
+
+    return xyz_all, rgb_all
+
+
+def to_point_cloud(points, colors):
+    """把 float32 (N, 3) 坐标和 uint8 (N, 3) 颜色包装成 tensor 点云（CPU 上不拷贝数据）"""
+    tpcd = o3d.t.geometry.PointCloud(o3d.core.Tensor.from_numpy(points))
+    tpcd.point.colors = o3d.core.Tensor.from_numpy(colors)
+    return tpcd
+
+
+def write_point_cloud(path, tpcd):
+    """以二进制 PLY 保存 tensor 点云，多帧合并后只写一个文件头"""
+    o3d.t.io.write_point_cloud(path, tpcd, write_ascii=False, compressed=True, print_progress=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由一帧或多帧 RGB-D 图像生成点云并保存为 PLY")
+    parser.add_argument("rgb_path", nargs="?", default="color_002.png", help="RGB 图像路径（默认：color_002.png）")
+    parser.add_argument("depth_path", nargs="?", default="depth_002.png",
+                        help="深度图路径，支持 16 位 PNG 和 .npy（默认：depth_002.png）")
+    parser.add_argument("--frames", default=None,
+                        help="多帧列表文件，每行 \"rgb_path depth_path [16 个数的相机到世界位姿]\"；"
+                             "给出时忽略上面两个路径，所有帧合并为一个点云")
+    parser.add_argument("-o", "--output", default="output.ply", help="输出 PLY 路径（默认：output.ply）")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="每隔 stride 个像素取一个点；2 时点数减为 1/4，适合快速预览（默认：1）")
+    parser.add_argument("--show", action=argparse.BooleanOptionalAction, default=False,
+                        help="保存后打开窗口查看点云（默认不打开，便于批处理）")
+    args = parser.parse_args()
+    if args.stride < 1:
+        parser.error("--stride 必须 >= 1")
+
+    if args.frames:
+        color_paths, depth_paths, poses = read_frame_list(args.frames)
+        height, width = load_depth(depth_paths[0]).shape  # 各帧分辨率相同
+    else:
+        depth, color = load_rgbd(args.rgb_path, args.depth_path)
+        height, width = depth.shape
+
+    # 相机内参设置（根据深度图分辨率）
+    fx, fy = 525.0, 525.0  # 焦距，可根据相机调整
+    cx, cy = width / 2, height / 2
+    depth_scale = 1000.0   # 如果深度图单位是毫米
+    depth_min = 0.3        # RealSense 的有效深度约为 0.3 ~ 5 米，范围外多为噪声，投影时直接丢弃
+    depth_trunc = 5.0
+
+    # 生成点云（只保留有效深度的像素）：单帧有 CUDA 时在 GPU 上计算，否则用 CPU 上的 numba / NumPy 实现
+    if args.frames:
+        tpcd = to_point_cloud(*batch_unproject(depth_paths, color_paths, (fx, fy, cx, cy), depth_scale, poses,
+                                               depth_trunc, args.stride, depth_min))
+    elif o3d.core.cuda.is_available():
+        tpcd = unproject_tensor(depth, color, fx, fy, cx, cy, depth_scale, depth_trunc,
+                                o3d.core.Device("CUDA:0"), args.stride, depth_min).cpu()
+        tpcd.point.colors = (tpcd.point.colors * 255.0 + 0.5).to(o3d.core.Dtype.UInt8)
+    else:
+        tpcd = to_point_cloud(*unproject_frame(depth, color, fx, fy, cx, cy, depth_scale, depth_trunc,
+                                               args.stride, depth_min))
+
+    # 先保存点云：二进制 PLY，位置用 float32、颜色用 uint8（而不是 double），文件约小一半
+    write_point_cloud(args.output, tpcd)
+    print(f"点云已保存为 {args.output}")
+
+    # 可视化点云（draw_geometries 会阻塞到窗口关闭，仅在 --show 时打开，也只有这时才转换为旧版点云）
+    if args.show:
+        o3d.visualization.draw_geometries([tpcd.to_legacy()])
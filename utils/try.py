@@ -2,6 +2,8 @@ import pyrealsense2 as rs
 import numpy as np
 import cv2
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 # -----------------------------
 # 配置 RealSense 管道
@@ -11,59 +13,126 @@ config = rs.config()
 config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)   # 深度流
 config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)  # RGB流
 
-# 启动管道
-profile = pipeline.start(config)
-
 # 对齐设置（把深度对齐到RGB）
 align_to = rs.stream.color
 align = rs.align(align_to)
 
+# SDK 内置的反投影：用相机自身内参把深度转成点云并计算到彩色图的纹理坐标
+pc = rs.pointcloud()
+
+# 只保存最新一帧；显示跟不上时旧帧直接丢弃
+latest_frames = queue.Queue(maxsize=1)
+
+
+def on_frames(frame):
+    # 在 librealsense 的 IO 线程中回调：完成对齐后交给主循环
+    if not frame.is_frameset():
+        return
+    aligned_frames = align.process(frame.as_frameset())
+    try:
+        latest_frames.get_nowait()
+    except queue.Empty:
+        pass
+    latest_frames.put_nowait(aligned_frames)
+
+
+# 启动管道（回调模式，不再由主线程调用 wait_for_frames）
+profile = pipeline.start(config, on_frames)
+
 # 创建保存路径
 save_path = "data"
 os.makedirs(save_path, exist_ok=True)
 frame_id = 0
 
-print("按 's' 保存RGB+Depth，按 'q' 退出")
+# 后台写盘线程：PNG 压缩不再阻塞取帧和显示
+writer = ThreadPoolExecutor(max_workers=2)
+
+
+def save_in_background(path, func, *args):
+    """在写盘线程中执行一次保存；失败时打印路径和原因，不会悄悄丢掉，也不会让主循环崩溃"""
+    def task():
+        try:
+            if func(path, *args) is False:  # cv2.imwrite 失败时返回 False
+                print(f"保存失败: {path}")
+        except Exception as e:
+            print(f"保存失败: {path} ({e})")
+    return writer.submit(task)
+
+
+# 排队中的点云导出任务会占住 SDK 帧池里的帧，最多同时保留这么多个
+max_pending_exports = 2
+pending_exports = []
+
+# 深度预览：预先计算 16 位深度 -> 8 位的查找表（等价于 convertScaleAbs(alpha=0.03)），
+# 并且只以一半分辨率、每隔一帧刷新一次
+depth_to_u8 = np.clip(np.rint(np.arange(65536) * 0.03), 0, 255).astype(np.uint8)
+frame_counter = 0
+
+# 连续这么多秒没有新帧（相机卡住或被拔出）就退出，与 wait_for_frames 默认的 5 秒超时一致
+max_missed_seconds = 5
+missed_seconds = 0
+
+print("按 's' 保存RGB+Depth+点云，按 'q' 退出")
 
 try:
     while True:
-        # 等待一帧
-        frames = pipeline.wait_for_frames()
+        # 等待回调送来的最新一帧（已对齐）
+        try:
+            aligned_frames = latest_frames.get(timeout=1.0)
+        except queue.Empty:
+            # 没有新帧时也要处理窗口事件，保证 'q' 仍然可以退出
+            if cv2.pollKey() & 0xFF == ord('q'):
+                break
+            missed_seconds += 1
+            if missed_seconds >= max_missed_seconds:
+                print(f"{max_missed_seconds} 秒内没有收到新帧，退出")
+                break
+            continue
+        missed_seconds = 0
 
-        # 对齐
-        aligned_frames = align.process(frames)
         aligned_depth = aligned_frames.get_depth_frame()
         color_frame = aligned_frames.get_color_frame()
 
         if not aligned_depth or not color_frame:
             continue
 
-        # 转 numpy 数组
-        depth_image = np.asanyarray(aligned_depth.get_data())
-        color_image = np.asanyarray(color_frame.get_data())
-
-        # 伪彩色深度图（仅用于显示）
-        depth_colormap = cv2.applyColorMap(
-            cv2.convertScaleAbs(depth_image, alpha=0.03),
-            cv2.COLORMAP_JET
-        )
+        # 转 numpy 数组（零拷贝只读视图，aligned_depth / color_frame 在本次循环内保持有效）
+        depth_image = np.frombuffer(aligned_depth.get_data(), dtype=np.uint16).reshape(
+            aligned_depth.get_height(), aligned_depth.get_width())
+        color_image = np.frombuffer(color_frame.get_data(), dtype=np.uint8).reshape(
+            color_frame.get_height(), color_frame.get_width(), 3)
 
         # 显示
         cv2.imshow('Color', color_image)
-        cv2.imshow('Depth', depth_colormap)
+        if frame_counter % 2 == 0:
+            # 伪彩色深度图（仅用于显示）：隔行隔列取样后查表
+            depth_colormap = cv2.applyColorMap(depth_to_u8[depth_image[::2, ::2]], cv2.COLORMAP_JET)
+            cv2.imshow('Depth', depth_colormap)
+        frame_counter += 1
 
-        # 键盘操作
-        key = cv2.waitKey(1) & 0xFF
+        # 键盘操作（pollKey 不阻塞，循环节奏由新帧到达控制）
+        key = cv2.pollKey() & 0xFF
         if key == ord('s'):
-            # 保存RGB和深度
-            cv2.imwrite(os.path.join(save_path, f"color_{frame_id:06d}.png"), color_image)
-            cv2.imwrite(os.path.join(save_path, f"depth_{frame_id:06d}.png"), depth_image)  # 16位PNG
-            print(f"保存第 {frame_id} 帧")
+            # 保存RGB和深度（先拷贝，帧缓冲区在本次循环后会被 SDK 回收）
+            save_in_background(os.path.join(save_path, f"color_{frame_id:06d}.png"), cv2.imwrite, color_image.copy())
+            # 深度直接保存为原始 uint16 的 .npy（无需压缩，基本只是一次内存拷贝）
+            save_in_background(os.path.join(save_path, f"depth_{frame_id:06d}.npy"), np.save, depth_image.copy())
+            # 点云由 SDK 计算并直接导出带颜色的 PLY，不经过 Python / Open3D
+            # （帧对象被任务引用，导出完成前不会被回收）
+            pc.map_to(color_frame)
+            points = pc.calculate(aligned_depth)
+            pending_exports = [f for f in pending_exports if not f.done()]
+            if len(pending_exports) >= max_pending_exports:
+                pending_exports.pop(0).result()  # 等最早的导出完成、释放它的帧
+            pending_exports.append(save_in_background(
+                os.path.join(save_path, f"cloud_{frame_id:06d}.ply"), points.export_to_ply, color_frame))
+            print(f"正在保存第 {frame_id} 帧")
             frame_id += 1
 
         elif key == ord('q'):
             break
 
 finally:
+    writer.shutdown(wait=True)  # 先等未完成的图像和点云写完（导出任务还引用着 SDK 的帧）
     pipeline.stop()
     cv2.destroyAllWindows()
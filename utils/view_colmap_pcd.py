@@ -1,10 +1,19 @@
 import open3d as o3d
+import numpy as np
 import argparse
 import os
 import sys
 
 
-def load_and_show_model(project_dir, model_type):
+# Model type -> (file name inside 'dense', geometry kind)
+MODEL_FILES = {
+    "f": ("fused.ply", "pcd"),
+    "p": ("meshed-poisson.ply", "mesh"),
+    "d": ("meshed-delaunay.ply", "mesh"),
+}
+
+
+def load_and_show_model(project_dir, model_type, full=False):
     """
     Load and visualize a dense reconstruction model (point cloud or mesh) from a COLMAP project.
 
@@ -14,19 +23,16 @@ def load_and_show_model(project_dir, model_type):
                           'f' - fused point cloud (.ply),
                           'p' - Poisson mesh (.ply),
                           'd' - Delaunay mesh (.ply).
+        full (bool): Show the fused point cloud at full resolution instead of voxel-downsampling it.
     """
     dense_dir = os.path.join(project_dir, "dense")  # Path to 'dense' directory
 
     # Determine file path based on selected model type
-    if model_type == "f":
-        file_path = os.path.join(dense_dir, "fused.ply")
-    elif model_type == "p":
-        file_path = os.path.join(dense_dir, "meshed-poisson.ply")
-    elif model_type == "d":
-        file_path = os.path.join(dense_dir, "meshed-delaunay.ply")
-    else:
+    if model_type not in MODEL_FILES:
         print(f"Unknown model type: {model_type}")
         sys.exit(1)
+    file_name, geometry_kind = MODEL_FILES[model_type]
+    file_path = os.path.join(dense_dir, file_name)
 
     # Check if the model file exists
     if not os.path.isfile(file_path):
@@ -36,15 +42,26 @@ def load_and_show_model(project_dir, model_type):
     print(f"Loading and displaying {model_type} model: {file_path}")
 
     # Load and visualize the model using Open3D
-    if model_type == "f":
-        # For fused point cloud, read as point cloud and display
-        pcd = o3d.io.read_point_cloud(file_path)
-        o3d.visualization.draw_geometries([pcd])
+    if geometry_kind == "pcd":
+        # For fused point cloud, read as point cloud and display.
+        # The tensor reader keeps the file's float32 positions / uint8 colors as flat arrays,
+        # roughly half the memory of the legacy double-precision point cloud; convert to
+        # legacy only for the viewer. NaN/Inf filtering is skipped, COLMAP writes finite points only.
+        tpcd = o3d.t.io.read_point_cloud(file_path, format="ply", remove_nan_points=False,
+                                         remove_infinite_points=False, print_progress=False)
+        if not full:
+            # Voxel-downsample to ~1/1000 of the bounding-box diagonal so the viewer stays responsive
+            diagonal = np.linalg.norm((tpcd.get_max_bound() - tpcd.get_min_bound()).numpy())
+            if diagonal > 0:
+                tpcd = tpcd.voxel_down_sample(diagonal / 1000.0)
+        o3d.visualization.draw_geometries([tpcd.to_legacy()])
     else:
-        # For meshes, read as triangle mesh, compute normals, and display
-        mesh = o3d.io.read_triangle_mesh(file_path)
-        mesh.compute_vertex_normals()
-        o3d.visualization.draw_geometries([mesh])
+        # For meshes, read as triangle mesh, compute normals only if the file has none, and display.
+        # The tensor mesh computes normals multi-threaded; the legacy one runs on a single core.
+        tmesh = o3d.t.io.read_triangle_mesh(file_path)
+        if "normals" not in tmesh.vertex:
+            tmesh.compute_vertex_normals()
+        o3d.visualization.draw_geometries([tmesh.to_legacy()])
 
 
 def main():
@@ -61,11 +78,16 @@ def main():
         default="f",
         help="Model type to view: f (Fused point cloud), p (Poisson mesh), d (Delaunay mesh). Default is 'f'."
     )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Show the fused point cloud at full resolution (default: voxel-downsampled for display)."
+    )
     args = parser.parse_args()
 
     # Prepend datasets path to the project directory
     full_project_dir = os.path.join("../datasets", args.project_dir)
-    load_and_show_model(full_project_dir, args.type)
+    load_and_show_model(full_project_dir, args.type, args.full)
 
 
 if __name__ == "__main__":